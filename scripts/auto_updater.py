@@ -5,21 +5,101 @@ Automatic Proxy Configuration Updater.
 Fetches and validates proxy servers from multiple sources.
 """
 
+import atexit
 import base64
+import binascii
+import functools
+import hashlib
 import json
 import logging
+import logging.handlers
+import queue
 import re
-import sys
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 from pathlib import Path
-from typing import Dict, List
-from urllib.parse import parse_qs, unquote, urlparse
+from typing import (
+    Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union,
+)
+from urllib.parse import unquote, urlparse
 
 import requests
-
-# Add the scripts directory to the path for local imports
-sys.path.insert(0, str(Path(__file__).parent))
-
-from proxy_generator import ProxyGenerator  # noqa: E402
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from .file_utils import atomic_write
+    from .module_loader import load_module
+except ImportError:  # run as a script, with scripts/ on sys.path
+    from file_utils import atomic_write  # type: ignore[no-redef]
+    from module_loader import load_module  # type: ignore[no-redef]
+
+# Load the sibling generator module by path instead of mutating sys.path
+proxy_generator = load_module(
+    f"{__package__}.proxy_generator" if __package__ else "proxy_generator",
+    Path(__file__).parent / "proxy_generator.py",
+)
+ProxyGenerator = proxy_generator.ProxyGenerator
+
+_URLSAFE_TO_STANDARD = bytes.maketrans(b'-_', b'+/')
+
+# Bump whenever URL parsing changes, so cached parse results are discarded
+_CACHE_VERSION = 1
+
+# Number of hosts published in the generated configs
+_MAX_SERVERS = 10
+
+# Ports the generator falls back to when a host lacks a protocol
+_DEFAULT_PORTS = {'shadowsocks': 8388, 'vmess': 10086, 'trojan': 443}
+
+# Hostname labels are split on these before looking up geo keywords
+_HOST_SEPARATORS_RE = re.compile(r'[-.]')
+
+_COUNTRY_KEYWORDS = {
+    'us': 'US', 'america': 'US',
+    'uk': 'GB', 'britain': 'GB',
+    'jp': 'JP', 'japan': 'JP',
+    'de': 'DE', 'german': 'DE', 'germany': 'DE',
+    'fr': 'FR', 'france': 'FR',
+    'sg': 'SG', 'singapore': 'SG',
+}
+_CITY_KEYWORDS = {
+    'newyork': 'New York', 'ny': 'New York',
+    'london': 'London',
+    'tokyo': 'Tokyo',
+    'frankfurt': 'Frankfurt',
+    'paris': 'Paris',
+    'singapore': 'Singapore',
+}
+
+
+@functools.lru_cache(maxsize=8192)
+def _guess_country(host_lower: str) -> str:
+    """Guess country from a lowercased hostname."""
+    for token in _HOST_SEPARATORS_RE.split(host_lower):
+        country = _COUNTRY_KEYWORDS.get(token)
+        if country:
+            return country
+    return 'XX'  # Unknown
+
+
+@functools.lru_cache(maxsize=8192)
+def _guess_city(host_lower: str) -> str:
+    """Guess city from a lowercased hostname."""
+    for token in _HOST_SEPARATORS_RE.split(host_lower):
+        city = _CITY_KEYWORDS.get(token)
+        if city:
+            return city
+    return 'Unknown'
+
+
+def _b64decode(data: Union[str, bytes]) -> bytes:
+    """Decode standard or URL-safe base64, tolerating missing padding."""
+    if isinstance(data, str):
+        data = data.encode('ascii')
+    # Drop line breaks first so they don't skew the padding length
+    raw = b''.join(data.split()).translate(_URLSAFE_TO_STANDARD)
+    return base64.b64decode(raw + b'=' * (-len(raw) % 4))
 
 
 class ProxyUpdater:
@@ -30,20 +110,83 @@ class ProxyUpdater:
         self.logger = self._setup_logging()
         self.generator = ProxyGenerator()
         self.sources = self._load_sources()
+        self.session = self._create_session()
+        self._parsers = {
+            b'ss': self._parse_shadowsocks_url,
+            b'vmess': self._parse_vmess_url,
+            b'trojan': self._parse_trojan_url,
+        }
+        log_dir = Path(__file__).parent.parent / "logs"
+        # Holds the caches even when logging was configured elsewhere
+        log_dir.mkdir(exist_ok=True)
+        self.cache_file = log_dir / "etag_cache.json"
+        self.digest_file = log_dir / "servers.digest"
+        self.source_cache = self._load_source_cache()
 
     def _setup_logging(self) -> logging.Logger:
         """Set up the logging configuration."""
+        if logging.getLogger().handlers:
+            # Already configured, e.g. by an earlier ProxyUpdater; basicConfig
+            # would ignore a new QueueHandler and its listener would leak
+            return logging.getLogger(__name__)
+
         log_dir = Path(__file__).parent.parent / "logs"
         log_dir.mkdir(exist_ok=True)
         log_file = log_dir / "updater.log"
 
+        # Records are formatted by the QueueHandler and written to the file
+        # and console on a listener thread, off the fetch and parse paths
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(
+            log_queue, logging.FileHandler(log_file), logging.StreamHandler()
+        )
+        listener.start()
+        atexit.register(listener.stop)
+
         logging.basicConfig(
             level=logging.INFO,
             format="%(asctime)s - %(levelname)s - %(message)s",
-            handlers=[logging.FileHandler(log_file), logging.StreamHandler()],
+            handlers=[logging.handlers.QueueHandler(log_queue)],
         )
         return logging.getLogger(__name__)
 
+    def _create_session(self) -> requests.Session:
+        """Create a pooled HTTP session shared by all source fetches."""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=32,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+            ),
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _load_source_cache(self) -> Dict[str, Dict]:
+        """Load cached HTTP validators and parsed servers for each source."""
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get("version") != _CACHE_VERSION:
+            # Servers parsed by older parsers must be fetched and parsed again
+            return {}
+        sources: Dict[str, Dict] = data.get("sources", {})
+        return sources
+
+    def _save_source_cache(self):
+        """Persist HTTP validators and parsed servers for the next run."""
+        data = {"version": _CACHE_VERSION, "sources": self.source_cache}
+        try:
+            atomic_write(self.cache_file, json.dumps(data).encode("utf-8"))
+        except OSError as e:
+            self.logger.warning(f"Failed to save source cache: {e}")
+
     def _load_sources(self) -> List[Dict]:
         """Load the configuration for proxy sources."""
         return [
@@ -79,85 +222,132 @@ class ProxyUpdater:
         ]
 
     def fetch_all_servers(self) -> List[Dict]:
-        """Fetch proxy servers from all configured sources."""
-        all_servers = []
+        """Fetch proxy servers from all configured sources concurrently."""
+        per_source = []
         self.logger.info("Starting proxy fetch from all sources...")
 
-        for source in self.sources:
-            try:
-                fetcher = getattr(self, f"_fetch_from_{source['type']}", None)
-                if not fetcher:
-                    self.logger.warning(
-                        f"No fetcher found for type: {source['type']}"
+        with ThreadPoolExecutor(max_workers=len(self.sources)) as executor:
+            futures = {
+                executor.submit(self._fetch_from_source, source): source
+                for source in self.sources
+            }
+            # Collect in source order so deduplication stays deterministic
+            for future, source in futures.items():
+                try:
+                    servers = future.result()
+                except Exception as e:
+                    self.logger.error(
+                        f"Failed to fetch from {source['name']}: {e}"
                     )
                     continue
 
-                servers = fetcher(source)
-                all_servers.extend(servers)
+                per_source.append(servers)
                 if servers:
                     self.logger.info(
                         f"Fetched {len(servers)} servers from {source['name']}"
                     )
 
-            except Exception as e:
-                self.logger.error(
-                    f"Failed to fetch from {source['name']}: {e}"
-                )
-
-        unique_servers = self._deduplicate_servers(all_servers)
+        self._save_source_cache()
+        unique_servers = self._deduplicate_servers(
+            chain.from_iterable(per_source)
+        )
         self.logger.info(
             f"Total unique proxy servers fetched: {len(unique_servers)}"
         )
         return unique_servers
 
+    def _fetch_from_source(self, source: Dict) -> List[Dict]:
+        """Dispatch a source to the fetcher matching its type."""
+        fetcher: Optional[Callable[[Dict], List[Dict]]] = getattr(
+            self, f"_fetch_from_{source['type']}", None
+        )
+        if not fetcher:
+            self.logger.warning(f"No fetcher found for type: {source['type']}")
+            return []
+        return fetcher(source)
+
     def _fetch_from_subscription(self, source: Dict) -> List[Dict]:
         """Fetch servers from subscription-based sources."""
-        response = requests.get(source["url"], timeout=30)
-        response.raise_for_status()
+        url = source["url"]
+        cached = self.source_cache.get(url, {})
+        headers = {}
+        if "servers" in cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        with self.session.get(url, headers=headers, timeout=30) as response:
+            if response.status_code == 304:
+                self.logger.info(f"{source['name']} unchanged since last fetch")
+                cached_servers: List[Dict] = cached["servers"]
+                return cached_servers
+            response.raise_for_status()
+            content = response.content
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
 
         try:
-            decoded_content = base64.b64decode(response.text).decode('utf-8')
-        except Exception:
-            decoded_content = response.text
+            decoded_content = _b64decode(content)
+        except binascii.Error:
+            decoded_content = content
+        if b'://' not in decoded_content:
+            # Plain-text lists can survive lenient base64 decoding as garbage
+            decoded_content = content
+
+        servers = list(
+            self._parse_subscription_lines(decoded_content, source['name'])
+        )
 
-        servers = []
-        lines = decoded_content.strip().split('\n')
+        self.source_cache[url] = {
+            "etag": etag,
+            "last_modified": last_modified,
+            "servers": servers,
+        }
+        return servers
 
-        for line in lines:
-            line = line.strip()
-            if not line:
+    def _parse_subscription_lines(
+        self, content: bytes, source_name: str
+    ) -> Iterator[Dict]:
+        """Yield servers parsed from decoded subscription content."""
+        for raw_line in content.splitlines():
+            raw_line = raw_line.strip()
+            scheme, sep, _ = raw_line.partition(b'://')
+            parser = self._parsers.get(scheme) if sep else None
+            if parser is None:
                 continue
 
+            # Only lines with a known scheme are decoded to str
+            line = raw_line.decode('utf-8', 'ignore')
             try:
-                server = None
-                if line.startswith('ss://'):
-                    server = self._parse_shadowsocks_url(line)
-                elif line.startswith('vmess://'):
-                    server = self._parse_vmess_url(line)
-                elif line.startswith('trojan://'):
-                    server = self._parse_trojan_url(line)
-
-                if server:
-                    server['source'] = source['name']
-                    servers.append(server)
-
+                server = parser(line)
             except Exception as e:
-                self.logger.debug(
-                    f"Failed to parse line: {line[:50]}... Error: {e}"
-                )
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(
+                        "Failed to parse line: %s... Error: %s", line[:50], e
+                    )
                 continue
 
-        return servers
+            if server:
+                server['source'] = source_name
+                yield server
 
     def _parse_shadowsocks_url(self, url: str) -> Dict:
         """Parse Shadowsocks URL format."""
-        match = re.match(r'ss://([^@]+)@([^:]+):(\d+)(?:#(.+))?', url)
-        if not match:
+        auth_b64, sep, rest = url[5:].partition('@')
+        if not sep:
+            return {}
+
+        address, _, name = rest.partition('#')
+        # Drop SIP002 plugin options such as "/?plugin=..."
+        address = address.partition('?')[0].rstrip('/')
+        host, _, port = address.rpartition(':')
+        host = host.strip('[]')  # IPv6 literals are bracketed
+        if not host or not port.isdigit():
             return {}
 
-        auth_b64, host, port, name = match.groups()
         try:
-            auth_decoded = base64.b64decode(auth_b64).decode('utf-8')
+            auth_decoded = _b64decode(auth_b64).decode('utf-8')
             method, password = auth_decoded.split(':', 1)
 
             return {
@@ -177,22 +367,23 @@ class ProxyUpdater:
             return {}
 
         try:
-            config_b64 = url[8:]
-            config_json = base64.b64decode(config_b64).decode('utf-8')
-            config = json.loads(config_json)
+            # json.loads detects the encoding of bytes input itself
+            config = json.loads(_b64decode(url[8:]))
+            get = config.get
+            host = get('add', '')
 
             return {
                 'protocol': 'vmess',
-                'host': config.get('add', ''),
-                'port': int(config.get('port', 0)),
-                'uuid': config.get('id', ''),
-                'alterId': int(config.get('aid', 0)),
-                'security': config.get('scy', 'auto'),
-                'network': config.get('net', 'tcp'),
-                'path': config.get('path', '/'),
-                'host_header': config.get('host', ''),
-                'tls': config.get('tls', '') == 'tls',
-                'name': config.get('ps', f"VMess-{config.get('add', '')}"),
+                'host': host,
+                'port': int(get('port', 0)),
+                'uuid': get('id', ''),
+                'alterId': int(get('aid', 0)),
+                'security': get('scy', 'auto'),
+                'network': get('net', 'tcp'),
+                'path': get('path', '/'),
+                'host_header': get('host', ''),
+                'tls': get('tls', '') == 'tls',
+                'name': get('ps') or f"VMess-{host}",
             }
         except Exception:
             return {}
@@ -203,26 +394,31 @@ class ProxyUpdater:
         if parsed.scheme != 'trojan':
             return {}
 
+        host = parsed.hostname
+        sni = host
+        for param in parsed.query.split('&'):
+            if param.startswith('sni='):
+                sni = unquote(param[4:]) or host
+                break
+
         return {
             'protocol': 'trojan',
-            'host': parsed.hostname,
+            'host': host,
             'port': parsed.port or 443,
             'password': parsed.username,
-            'sni': parse_qs(parsed.query).get('sni', [parsed.hostname])[0],
+            'sni': sni,
             'name': (unquote(parsed.fragment) if parsed.fragment
-                     else f"Trojan-{parsed.hostname}"),
+                     else f"Trojan-{host}"),
         }
 
-    def _deduplicate_servers(self, servers: List[Dict]) -> List[Dict]:
+    def _deduplicate_servers(self, servers: Iterable[Dict]) -> List[Dict]:
         """Remove duplicate servers based on host and port."""
-        seen = set()
-        unique_servers = []
+        unique_servers: Dict[tuple, Dict] = {}
         for server in servers:
-            key = f"{server.get('host')}:{server.get('port')}"
-            if key not in seen:
-                seen.add(key)
-                unique_servers.append(server)
-        return unique_servers
+            key = (server.get('host'), server.get('port'))
+            if key not in unique_servers:
+                unique_servers[key] = server
+        return list(unique_servers.values())
 
     def run(self):
         """Run the full update process."""
@@ -231,16 +427,73 @@ class ProxyUpdater:
             self.logger.warning("No servers fetched. Exiting.")
             return
 
+        digest = self._servers_digest(servers)
+        last_digest, last_outputs = self._load_last_digests()
+        # Regenerate if the files went missing or were overwritten since
+        if (
+            digest == last_digest
+            and last_outputs
+            and last_outputs == self._outputs_digest()
+        ):
+            self.logger.info(
+                "Server list unchanged since last run. Skipping regeneration."
+            )
+            return
+
         converted_servers = self._convert_servers_format(servers)
 
         self.generator.update_servers(converted_servers)
         self.generator.generate_all_configs()
+        self._save_last_digests(digest, self._outputs_digest())
 
         self.logger.info(
             f"Proxy update process finished. "
             f"Generated configs for {len(converted_servers)} servers."
         )
 
+    def _servers_digest(self, servers: List[Dict]) -> str:
+        """Hash the fetched server identities, in fetch order."""
+        digest = hashlib.blake2b(digest_size=16)
+        # A new output format must regenerate even for the same servers
+        digest.update(f"{proxy_generator.OUTPUT_FORMAT_VERSION}\n".encode())
+        for server in servers:
+            digest.update(
+                f"{server.get('protocol')}|{server.get('host')}|"
+                f"{server.get('port')}\n".encode()
+            )
+        return digest.hexdigest()
+
+    def _outputs_digest(self) -> str:
+        """Hash the generated config files, or "" if any is missing."""
+        digest = hashlib.blake2b(digest_size=16)
+        try:
+            for path in self.generator.output_paths():
+                digest.update(path.read_bytes())
+                digest.update(b"\0")
+        except OSError:
+            return ""
+        return digest.hexdigest()
+
+    def _load_last_digests(self) -> Tuple[str, str]:
+        """Load the server and output digests of the last generation."""
+        try:
+            fields = self.digest_file.read_text(encoding="utf-8").split()
+        except OSError:
+            return "", ""
+        if len(fields) != 2:
+            return "", ""
+        return fields[0], fields[1]
+
+    def _save_last_digests(self, servers_digest: str, outputs_digest: str):
+        """Record the server and output digests of a successful generation."""
+        try:
+            atomic_write(
+                self.digest_file,
+                f"{servers_digest}\n{outputs_digest}\n".encode(),
+            )
+        except OSError as e:
+            self.logger.warning(f"Failed to save server digest: {e}")
+
     def _convert_servers_format(self, servers: List[Dict]) -> List[Dict]:
         """Convert fetched servers to ProxyGenerator format."""
         host_groups: Dict[str, Dict] = {}
@@ -249,49 +502,25 @@ class ProxyUpdater:
             if not host:
                 continue
 
-            if host not in host_groups:
-                host_groups[host] = {
+            group = host_groups.get(host)
+            if group is None:
+                if len(host_groups) >= _MAX_SERVERS:
+                    # Still merge ports into kept hosts, but add no new ones
+                    continue
+                host_lower = host.lower()
+                group = host_groups[host] = {
                     'host': host,
-                    'country': self._guess_country_from_host(host),
-                    'city': self._guess_city_from_host(host),
-                    'ports': {}
+                    'country': _guess_country(host_lower),
+                    'city': _guess_city(host_lower),
+                    'ports': dict(_DEFAULT_PORTS),
                 }
 
             protocol = server.get('protocol')
             port = server.get('port')
+            if port and protocol in _DEFAULT_PORTS:
+                group['ports'][protocol] = port
 
-            if protocol and port:
-                if protocol == 'shadowsocks':
-                    host_groups[host]['ports']['shadowsocks'] = port
-                elif protocol == 'vmess':
-                    host_groups[host]['ports']['vmess'] = port
-                elif protocol == 'trojan':
-                    host_groups[host]['ports']['trojan'] = port
-
-        converted = list(host_groups.values())
-        return converted[:10]  # Limit to 10 servers
-
-    def _guess_country_from_host(self, host: str) -> str:
-        """Guess country from hostname."""
-        host_lower = host.lower()
-        if 'us' in host_lower or 'america' in host_lower:
-            return 'US'
-        if 'uk' in host_lower or 'britain' in host_lower:
-            return 'GB'
-        if 'jp' in host_lower or 'japan' in host_lower:
-            return 'JP'
-        return 'XX'  # Unknown
-
-    def _guess_city_from_host(self, host: str) -> str:
-        """Guess city from hostname."""
-        host_lower = host.lower()
-        if 'newyork' in host_lower or 'ny' in host_lower:
-            return 'New York'
-        if 'london' in host_lower:
-            return 'London'
-        if 'tokyo' in host_lower:
-            return 'Tokyo'
-        return 'Unknown'
+        return list(host_groups.values())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,23 @@
+"""
+Script File Utilities.
+
+Shared file helpers for the generator, updater and setup scripts.
+"""
+
+import os
+from pathlib import Path
+
+
+def atomic_write(path: Path, data: bytes):
+    """Replace ``path`` with ``data`` so readers never see a partial file."""
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    try:
+        # The buffered writer retries short writes until all data is out
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
@@ -0,0 +1,21 @@
+"""
+Script Module Loader.
+
+Loads sibling scripts by file path, without adding scripts/ to sys.path.
+Callers import this module package-relative, falling back to a plain
+import when run directly as scripts.
+"""
+
+import importlib.util
+from pathlib import Path
+from types import ModuleType
+
+
+def load_module(name: str, path: Path) -> ModuleType:
+    """Load and execute the module at ``path`` under ``name``."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    if spec is None or spec.loader is None:
+        raise ImportError(f"Cannot load {name} from {path}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
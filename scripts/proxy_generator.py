@@ -5,18 +5,58 @@ Proxy Configuration Generator.
 Generates secure proxy configurations for various protocols.
 """
 
-import base64
+import binascii
+import functools
 import json
-import random
+import os
+import secrets
 import string
-import uuid
-from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
 from urllib.parse import quote
 
+try:
+    from .file_utils import atomic_write
+except ImportError:  # run as a script, with scripts/ on sys.path
+    from file_utils import atomic_write  # type: ignore[no-redef]
+
+# Bump whenever the generated subscription format changes
+OUTPUT_FORMAT_VERSION = 1
+
+# Files written by generate_all_configs into the configs directory, in the
+# order it builds their contents
+OUTPUT_FILES = (
+    "shadowsocks.txt", "v2ray.txt", "universal.txt", "universal-base64.txt",
+)
+
+# 64 symbols, so masking each random byte to 6 bits picks uniformly
+_PASSWORD_ALPHABET = string.ascii_letters + string.digits + "-_"
+_PASSWORD_TABLE = bytes(
+    ord(_PASSWORD_ALPHABET[byte & 63]) for byte in range(256)
+)
+
+
+@functools.lru_cache(maxsize=1024)
+def _quoted_remarks(prefix: str, country: str, city: str) -> str:
+    """URL-quote a share link remark, e.g. "SS-US-New%20York"."""
+    return quote(f"{prefix}-{country}-{city}")
+
+
+def _uuid4_str() -> str:
+    """Return a random RFC 4122 version 4 UUID in canonical string form."""
+    b = bytearray(os.urandom(16))
+    b[6] = (b[6] & 0x0F) | 0x40
+    b[8] = (b[8] & 0x3F) | 0x80
+    h = b.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
 
 class ProxyGenerator:
     """Generates various proxy configurations."""
 
+    __slots__ = ("servers",)
+
     def __init__(self):
         """Initializes the ProxyGenerator."""
         self.servers: List[Dict] = []
@@ -26,9 +66,9 @@ class ProxyGenerator:
         self.servers = new_servers
 
     def _generate_password(self, length: int = 16) -> str:
-        """Generate a random password."""
-        return ''.join(
-            random.choices(string.ascii_letters + string.digits, k=length)
+        """Generate a cryptographically secure random password."""
+        return (
+            secrets.token_bytes(length).translate(_PASSWORD_TABLE).decode("ascii")
         )
 
     def generate_shadowsocks_config(self, server: Dict) -> Dict:
@@ -44,7 +84,7 @@ class ProxyGenerator:
 
     def generate_vmess_config(self, server: Dict) -> Dict:
         """Generate VMess configuration."""
-        user_id = str(uuid.uuid4())
+        user_id = _uuid4_str()
         return {
             "v": "2",
             "ps": f"VMess-{server['country']}-{server['city']}",
@@ -73,71 +113,129 @@ class ProxyGenerator:
             },
         }
 
+    def _shadowsocks_url(self, server: Dict) -> str:
+        """Build a Shadowsocks share URL for a server."""
+        ss_config = self.generate_shadowsocks_config(server)
+        auth_str = f"{ss_config['method']}:{ss_config['password']}"
+        auth_b64 = binascii.b2a_base64(
+            auth_str.encode(), newline=False
+        ).decode('ascii')
+        remarks = _quoted_remarks('SS', server['country'], server['city'])
+        return (
+            f"ss://{auth_b64}@{server['host']}:"
+            f"{ss_config['server_port']}#{remarks}"
+        )
+
+    def _vmess_url(self, server: Dict) -> str:
+        """Build a VMess share URL for a server."""
+        # Fixed schema, so fill a template; only the free-text fields need
+        # JSON escaping. Matches generate_vmess_config key for key.
+        host = json.dumps(server["host"])
+        ps = json.dumps(f"VMess-{server['country']}-{server['city']}")
+        port = server["ports"].get("vmess", 10086)
+        vmess_json = (
+            f'{{"v":"2","ps":{ps},"add":{host},"port":"{port}",'
+            f'"id":"{_uuid4_str()}","aid":"0","scy":"auto","net":"ws",'
+            f'"type":"none","host":{host},"path":"/vmess","tls":"tls",'
+            f'"sni":{host}}}'
+        )
+        vmess_b64 = binascii.b2a_base64(
+            vmess_json.encode(), newline=False
+        ).decode('ascii')
+        return f"vmess://{vmess_b64}"
+
+    def _trojan_url(self, server: Dict) -> str:
+        """Build a Trojan share URL for a server."""
+        trojan_config = self.generate_trojan_config(server)
+        remarks = _quoted_remarks('Trojan', server['country'], server['city'])
+        return (
+            f"trojan://{trojan_config['password']}@"
+            f"{server['host']}:{trojan_config['remote_port']}"
+            f"?sni={server['host']}#{remarks}"
+        )
+
     def export_shadowsocks_subscription(self) -> str:
         """Export Shadowsocks subscription."""
-        configs = []
-        for server in self.servers:
-            ss_config = self.generate_shadowsocks_config(server)
-            auth_str = f"{ss_config['method']}:{ss_config['password']}"
-            auth_b64 = base64.b64encode(auth_str.encode()).decode()
-            ss_url = (
-                f"ss://{auth_b64}@{server['host']}:"
-                f"{ss_config['server_port']}#{quote(ss_config['remarks'])}"
-            )
-            configs.append(ss_url)
-        return '\n'.join(configs)
+        url = self._shadowsocks_url
+        return '\n'.join([url(server) for server in self.servers])
 
     def export_vmess_subscription(self) -> str:
         """Export VMess subscription."""
-        configs = []
-        for server in self.servers:
-            vmess_config = self.generate_vmess_config(server)
-            vmess_json = json.dumps(vmess_config, separators=(',', ':'))
-            vmess_b64 = base64.b64encode(vmess_json.encode()).decode()
-            configs.append(f"vmess://{vmess_b64}")
-        return '\n'.join(configs)
+        url = self._vmess_url
+        return '\n'.join([url(server) for server in self.servers])
 
     def export_trojan_subscription(self) -> str:
         """Export Trojan subscription."""
-        configs = []
+        url = self._trojan_url
+        return '\n'.join([url(server) for server in self.servers])
+
+    def _build_all_lines(self) -> Tuple[List[str], List[str], List[str]]:
+        """Build the ss, vmess and trojan URLs in a single pass over servers."""
+        ss_urls: List[str] = []
+        vmess_urls: List[str] = []
+        trojan_urls: List[str] = []
+        # Bind the per-server calls once rather than per iteration
+        add_ss, add_vmess, add_trojan = (
+            ss_urls.append, vmess_urls.append, trojan_urls.append
+        )
+        ss_url, vmess_url, trojan_url = (
+            self._shadowsocks_url, self._vmess_url, self._trojan_url
+        )
         for server in self.servers:
-            trojan_config = self.generate_trojan_config(server)
-            trojan_url = (
-                f"trojan://{trojan_config['password']}@"
-                f"{server['host']}:{trojan_config['remote_port']}"
-                f"?sni={server['host']}#"
-                f"{quote(f'Trojan-{server['country']}-{server['city']}')}"
-            )
-            configs.append(trojan_url)
-        return '\n'.join(configs)
+            add_ss(ss_url(server))
+            add_vmess(vmess_url(server))
+            add_trojan(trojan_url(server))
+        return ss_urls, vmess_urls, trojan_urls
 
     def export_universal_subscription(self) -> str:
         """Export universal subscription in plain text."""
-        all_configs = (
-            self.export_shadowsocks_subscription().split('\n')
-            + self.export_vmess_subscription().split('\n')
-            + self.export_trojan_subscription().split('\n')
-        )
-        return '\n'.join(filter(None, all_configs))
+        ss_urls, vmess_urls, trojan_urls = self._build_all_lines()
+        return '\n'.join(ss_urls + vmess_urls + trojan_urls)
 
     def export_universal_subscription_base64(self) -> str:
         """Export universal subscription in base64 format."""
         content = self.export_universal_subscription()
-        return base64.b64encode(content.encode()).decode()
+        return binascii.b2a_base64(content.encode(), newline=False).decode('ascii')
+
+    def _write_config(self, path: Path, content: Union[str, bytes]):
+        """Atomically replace a config file so readers never see a partial one."""
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        atomic_write(path, content)
+
+    def _config_dir(self) -> Path:
+        """Directory the generated subscription files are written to."""
+        return Path(__file__).parent.parent / "configs"
+
+    def output_paths(self) -> List[Path]:
+        """Paths of the files written by generate_all_configs."""
+        config_dir = self._config_dir()
+        return [config_dir / name for name in OUTPUT_FILES]
 
     def generate_all_configs(self):
         """Generate all configuration files."""
-        config_dir = Path(__file__).parent.parent / "configs"
+        config_dir = self._config_dir()
         config_dir.mkdir(exist_ok=True)
 
-        with open(config_dir / "shadowsocks.txt", "w") as f:
-            f.write(self.export_shadowsocks_subscription())
-        with open(config_dir / "v2ray.txt", "w") as f:
-            f.write(self.export_vmess_subscription())
-        with open(config_dir / "universal.txt", "w") as f:
-            f.write(self.export_universal_subscription())
-        with open(config_dir / "universal-base64.txt", "w") as f:
-            f.write(self.export_universal_subscription_base64())
+        # One pass builds every link, so the per-protocol files and the
+        # universal ones share the same generated credentials
+        ss_urls, vmess_urls, trojan_urls = self._build_all_lines()
+        universal = '\n'.join(ss_urls + vmess_urls + trojan_urls).encode()
+        # Named from OUTPUT_FILES so the updater's output digest covers them all
+        outputs: Dict[str, bytes] = dict(zip(OUTPUT_FILES, (
+            '\n'.join(ss_urls).encode(),
+            '\n'.join(vmess_urls).encode(),
+            universal,
+            binascii.b2a_base64(universal, newline=False),
+        )))
+        # The four files are independent, so overlap their writes
+        with ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+            futures = [
+                executor.submit(self._write_config, config_dir / name, content)
+                for name, content in outputs.items()
+            ]
+            for future in futures:
+                future.result()
 
 
 if __name__ == "__main__":
@@ -3,39 +3,101 @@ Setup Script for Free Proxy Configurations
 Automates the initial setup and configuration of the project.
 """
 
-import json
+import argparse
+import importlib.metadata
+import os
 import platform
+import re
+import shutil
+import string
 import subprocess
 import sys
 from pathlib import Path
+from types import ModuleType
+from typing import Optional, Set
+
+try:
+    from .file_utils import atomic_write
+    from .module_loader import load_module
+except ImportError:  # run as a script, with scripts/ on sys.path
+    from file_utils import atomic_write  # type: ignore[no-redef]
+    from module_loader import load_module  # type: ignore[no-redef]
+
+REQUIRED_PACKAGES = (
+    "requests", "pyyaml", "jsonschema", "cryptography",
+    "schedule", "python-dotenv", "jinja2", "click", "rich",
+)
+
+_NAME_SEPARATORS_RE = re.compile(r"[-_.]+")
+
+_SERVICE_TEMPLATE = string.Template("""[Unit]
+Description=Free Proxy Configurations Auto-Updater
+After=network.target
+
+[Service]
+ExecStart=$python $updater
+WorkingDirectory=$root
+Restart=always
+User=root
+
+[Install]
+WantedBy=multi-user.target
+""")
+
+
+def _normalize_name(name: str) -> str:
+    """Normalize a distribution name as pip does (PEP 503)."""
+    return _NAME_SEPARATORS_RE.sub("-", name).lower()
 
 
 class ProxySetup:
     """Handles the automated setup process for the project."""
 
+    __slots__ = (
+        "project_root", "config_dir", "logs_dir", "scripts_dir",
+        "templates_dir", "backups_dir", "_pg_module",
+    )
+
     def __init__(self):
         self.project_root = Path(__file__).parent.parent
         self.config_dir = self.project_root / "configs"
         self.logs_dir = self.project_root / "logs"
         self.scripts_dir = self.project_root / "scripts"
+        self.templates_dir = self.project_root / "templates"
+        self.backups_dir = self.project_root / "backups"
+        self._pg_module: Optional[ModuleType] = None
 
     def check_dependencies(self) -> bool:
         """Check for and install required Python packages."""
         print("🔍 Checking dependencies...")
-        required = [
-            "requests", "pyyaml", "jsonschema", "cryptography",
-            "schedule", "python-dotenv", "jinja2", "click", "rich",
+        installed = self._installed_distributions()
+        missing = [
+            pkg for pkg in REQUIRED_PACKAGES if _normalize_name(pkg) not in installed
         ]
-        missing = [pkg for pkg in required if not self._is_installed(pkg)]
 
         if not missing:
             print("✅ All dependencies are already installed.")
             return True
 
         print(f"\n📦 Installing missing packages: {', '.join(missing)}")
+        uv = shutil.which("uv")
+        if uv:
+            try:
+                subprocess.check_call(
+                    [uv, "pip", "install", "--python", sys.executable, *missing]
+                )
+                print("✅ Dependencies installed successfully.")
+                return True
+            except subprocess.CalledProcessError:
+                print("   ⚠️  uv install failed, falling back to pip.")
         try:
             subprocess.check_call(
-                [sys.executable, "-m", "pip", "install", *missing]
+                [
+                    sys.executable, "-m", "pip", "install",
+                    "--disable-pip-version-check", "--no-input", "-q",
+                    *missing,
+                ],
+                env={**os.environ, "PIP_DISABLE_PIP_VERSION_CHECK": "1"},
             )
             print("✅ Dependencies installed successfully.")
             return True
@@ -44,13 +106,17 @@ class ProxySetup:
                   "Please install them manually.")
             return False
 
-    def _is_installed(self, package_name: str) -> bool:
-        """Check if a package is installed."""
-        try:
-            __import__(package_name.replace("-", "_"))
-            return True
-        except ImportError:
-            return False
+    def _installed_distributions(self) -> Set[str]:
+        """Return the normalized names of all installed distributions."""
+        # Reads package metadata only; no package code is imported
+        return {
+            _normalize_name(name)
+            for name in (
+                dist.metadata["Name"]
+                for dist in importlib.metadata.distributions()
+            )
+            if name
+        }
 
     def create_directories(self) -> None:
         """Create necessary project directories."""
@@ -58,50 +124,52 @@ class ProxySetup:
         dirs_to_create = [
             self.config_dir,
             self.logs_dir,
-            self.project_root / "templates",
-            self.project_root / "backups",
+            self.templates_dir,
+            self.backups_dir,
         ]
+        messages = []
         for directory in dirs_to_create:
-            directory.mkdir(exist_ok=True)
-            print(f"   ✅ Created or already exists: "
-                  f"{directory.relative_to(self.project_root)}")
+            # A stat is cheaper than a mkdir that fails with EEXIST
+            if not os.path.isdir(directory):
+                os.makedirs(directory, exist_ok=True)
+            messages.append(f"   ✅ Created or already exists: "
+                            f"{directory.relative_to(self.project_root)}")
+        print("\n".join(messages))
 
     def generate_initial_configs(self) -> None:
         """Generate initial configuration files using the proxy_generator."""
         print("⚙️  Generating initial configurations...")
-        # Temporarily add scripts directory to the path for local import
-        sys.path.insert(0, str(self.scripts_dir))
         try:
-            from proxy_generator import ProxyGenerator
-            generator = ProxyGenerator()
-
-            # A map of filenames to their generator functions for cleaner code
-            configs_to_generate = {
-                "singbox.json": generator.generate_singbox_config,
-                "universal.txt": generator.export_universal_subscription,
-                "shadowsocks.txt": generator.export_shadowsocks_subscription,
-                "v2ray.txt": generator.export_vmess_subscription,
-            }
-
-            for filename, func in configs_to_generate.items():
-                content = func()
-                out_path = self.config_dir / filename
-                with out_path.open("w", encoding="utf-8") as f:
-                    if isinstance(content, dict):
-                        json.dump(content, f, indent=2)
-                    else:
-                        f.write(content)
-                print(f"   ✅ Generated {filename}")
-
-        except ImportError:
+            generator = self._load_generator_module().ProxyGenerator()
+
+            # Setup knows no servers yet, so never clobber published configs
+            # with empty ones; auto_updater.py refreshes them
+            existing = [p for p in generator.output_paths() if p.exists()]
+            if existing:
+                print("   ⚠️  Skipping: configurations already exist "
+                      "(run scripts/auto_updater.py to refresh them).")
+                return
+
+            # Write the full set at once so the four files stay consistent
+            generator.generate_all_configs()
+            for path in generator.output_paths():
+                print(f"   ✅ Generated {path.name}")
+
+        except (ImportError, FileNotFoundError):
             print(f"   ❌ Error: Could not import ProxyGenerator from "
                   f"{self.scripts_dir}.")
         except Exception as e:
             print(f"   ❌ Failed to generate configurations: {e}")
-        finally:
-            # Clean up the path modification
-            if str(self.scripts_dir) in sys.path:
-                sys.path.remove(str(self.scripts_dir))
+
+    def _load_generator_module(self) -> ModuleType:
+        """Load scripts/proxy_generator.py by path, once per instance."""
+        if self._pg_module is None:
+            self._pg_module = load_module(
+                f"{__package__}.proxy_generator" if __package__
+                else "proxy_generator",
+                self.scripts_dir / "proxy_generator.py",
+            )
+        return self._pg_module
 
     def create_systemd_service(self) -> None:
         """Generate a systemd service file for the auto-updater."""
@@ -110,22 +178,15 @@ class ProxySetup:
             print("   ⚠️  Skipping: Systemd is only available on Linux.")
             return
 
-        updater_script_path = self.scripts_dir / "auto_updater.py"
-        service_content = f"""[Unit]
-Description=Free Proxy Configurations Auto-Updater
-After=network.target
-
-[Service]
-ExecStart={sys.executable} {updater_script_path}
-WorkingDirectory={self.project_root}
-Restart=always
-User=root
-
-[Install]
-WantedBy=multi-user.target
-"""
+        service_content = _SERVICE_TEMPLATE.substitute(
+            python=sys.executable,
+            updater=self.scripts_dir / "auto_updater.py",
+            root=self.project_root,
+        )
         service_file = self.project_root / "proxy-updater.service"
-        service_file.write_text(service_content, encoding="utf-8")
+        # Same atomic temp-file + rename write as the generated configs, so a
+        # crash never leaves a truncated service file behind
+        atomic_write(service_file, service_content.encode("utf-8"))
 
         print("   ✅ Service file 'proxy-updater.service' "
               "created in project root.")
@@ -136,11 +197,30 @@ WantedBy=multi-user.target
 
 def main():
     """Run the complete setup process."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--skip-configs", action="store_true",
+        help="do not generate the initial subscription files",
+    )
+    parser.add_argument(
+        "--skip-service", action="store_true",
+        help="do not write the systemd service file",
+    )
+    # Older callers (CI, docs) still pass these; setup has no such steps
+    for legacy_flag in ("--skip-cron", "--skip-tests"):
+        parser.add_argument(
+            legacy_flag, action="store_true",
+            help="no-op, accepted for backwards compatibility",
+        )
+    args = parser.parse_args()
+
     setup = ProxySetup()
     if setup.check_dependencies():
         setup.create_directories()
-        setup.generate_initial_configs()
-        setup.create_systemd_service()
+        if not args.skip_configs:
+            setup.generate_initial_configs()
+        if not args.skip_service:
+            setup.create_systemd_service()
         print("\n🎉 Setup complete!")
 
 
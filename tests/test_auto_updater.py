@@ -0,0 +1,288 @@
+"""Tests for proxy URL parsing and server handling in the auto updater."""
+
+import base64
+import json
+import logging
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "scripts"))
+
+auto_updater = pytest.importorskip("auto_updater")
+
+
+@pytest.fixture
+def updater():
+    """A ProxyUpdater without logging, network session or cache side effects."""
+    return auto_updater.ProxyUpdater.__new__(auto_updater.ProxyUpdater)
+
+
+def _b64(text: str) -> str:
+    return base64.b64encode(text.encode()).decode()
+
+
+@pytest.mark.parametrize(
+    "url, host, port, name",
+    [
+        (f"ss://{_b64('aes-256-gcm:secret')}@1.2.3.4:8388#My%20SS",
+         "1.2.3.4", 8388, "My SS"),
+        # SIP002 links use unpadded URL-safe base64 and may carry plugins
+        ("ss://YWVzLTI1Ni1nY206c2VjcmV0@ex.com:443/?plugin=obfs#x",
+         "ex.com", 443, "x"),
+        (f"ss://{_b64('aes-256-gcm:secret')}@[2001:db8::1]:8388",
+         "2001:db8::1", 8388, "SS-2001:db8::1"),
+    ],
+)
+def test_parse_shadowsocks_url(updater, url, host, port, name):
+    """Shadowsocks links yield host, port, credentials and a name."""
+    server = updater._parse_shadowsocks_url(url)
+    assert server["host"] == host
+    assert server["port"] == port
+    assert server["method"] == "aes-256-gcm"
+    assert server["password"] == "secret"
+    assert server["name"] == name
+
+
+@pytest.mark.parametrize(
+    "url", ["ss://no-at-sign", "ss://abc@host-without-port", "ss://abc@h:x"]
+)
+def test_parse_shadowsocks_url_rejects_malformed(updater, url):
+    """Malformed Shadowsocks links are rejected with an empty dict."""
+    assert updater._parse_shadowsocks_url(url) == {}
+
+
+def test_parse_vmess_url(updater):
+    """VMess links decode their base64 JSON payload."""
+    payload = {"add": "v.example.com", "port": "443", "id": "uuid", "tls": "tls"}
+    server = updater._parse_vmess_url(f"vmess://{_b64(json.dumps(payload))}")
+    assert server["host"] == "v.example.com"
+    assert server["port"] == 443
+    assert server["tls"] is True
+    assert server["name"] == "VMess-v.example.com"
+
+
+@pytest.mark.parametrize(
+    "url, sni",
+    [
+        ("trojan://pw@t.example.com:8443?alpn=h2&sni=cdn.example.com#t",
+         "cdn.example.com"),
+        ("trojan://pw@t.example.com:8443?sni=#t", "t.example.com"),
+        ("trojan://pw@t.example.com:8443#t", "t.example.com"),
+    ],
+)
+def test_parse_trojan_url_sni(updater, url, sni):
+    """Trojan links take sni from the query, defaulting to the host."""
+    server = updater._parse_trojan_url(url)
+    assert server["port"] == 8443
+    assert server["password"] == "pw"
+    assert server["sni"] == sni
+
+
+def test_deduplicate_servers_keeps_first(updater):
+    """Duplicates by host and port keep the first occurrence, in order."""
+    servers = [
+        {"host": "a", "port": 1, "source": "first"},
+        {"host": "b", "port": 1, "source": "first"},
+        {"host": "a", "port": 1, "source": "second"},
+        {"host": "a", "port": 2, "source": "second"},
+    ]
+    unique = updater._deduplicate_servers(iter(servers))
+    assert [(s["host"], s["port"], s["source"]) for s in unique] == [
+        ("a", 1, "first"), ("b", 1, "first"), ("a", 2, "second")
+    ]
+
+
+def test_source_cache_roundtrip(updater, tmp_path):
+    """The source cache survives a save and load."""
+    updater.cache_file = tmp_path / "etag_cache.json"
+    updater.source_cache = {"https://x": {"etag": "e", "servers": []}}
+    updater._save_source_cache()
+    assert updater._load_source_cache() == updater.source_cache
+
+
+def test_source_cache_discards_other_versions(updater, tmp_path):
+    """Caches from an older format or parser version are ignored."""
+    updater.cache_file = tmp_path / "etag_cache.json"
+    updater.cache_file.write_text(json.dumps({"https://x": {"servers": []}}))
+    assert updater._load_source_cache() == {}
+    updater.cache_file.write_text(json.dumps(
+        {"version": auto_updater._CACHE_VERSION - 1, "sources": {"a": {}}}
+    ))
+    assert updater._load_source_cache() == {}
+
+
+class _FakeGenerator:
+    """Records generate_all_configs calls and writes one output file."""
+
+    def __init__(self, output):
+        self.output = output
+        self.servers = []
+        self.calls = 0
+        self.fail = False
+
+    def update_servers(self, servers):
+        self.servers = servers
+
+    def output_paths(self):
+        return [self.output]
+
+    def generate_all_configs(self):
+        self.calls += 1
+        if self.fail:
+            raise OSError("disk full")
+        self.output.write_text(repr(self.servers))
+
+
+@pytest.fixture
+def run_updater(updater, tmp_path):
+    """An updater whose run() uses fixed servers and a fake generator."""
+    servers = [{"protocol": "trojan", "host": "a.example.com", "port": 443}]
+    updater.logger = logging.getLogger("test_auto_updater")
+    updater.digest_file = tmp_path / "servers.digest"
+    updater.generator = _FakeGenerator(tmp_path / "universal.txt")
+    updater.fetch_all_servers = lambda: [dict(s) for s in servers]
+    return updater
+
+
+def test_run_skips_unchanged_servers(run_updater):
+    """A second run with the same servers and outputs is skipped."""
+    run_updater.run()
+    run_updater.run()
+    assert run_updater.generator.calls == 1
+
+
+@pytest.mark.parametrize("change", ["delete", "overwrite", "format"])
+def test_run_regenerates_when_outputs_stale(run_updater, monkeypatch, change):
+    """Missing, overwritten or outdated outputs force regeneration."""
+    run_updater.run()
+    output = run_updater.generator.output
+    if change == "delete":
+        output.unlink()
+    elif change == "overwrite":
+        output.write_text("sample configs")
+    else:
+        monkeypatch.setattr(
+            auto_updater.proxy_generator, "OUTPUT_FORMAT_VERSION",
+            auto_updater.proxy_generator.OUTPUT_FORMAT_VERSION + 1,
+        )
+    run_updater.run()
+    assert run_updater.generator.calls == 2
+
+
+def test_run_saves_digest_only_after_success(run_updater):
+    """A failed generation leaves no digest, so the next run retries."""
+    run_updater.generator.fail = True
+    with pytest.raises(OSError):
+        run_updater.run()
+    assert not run_updater.digest_file.exists()
+
+    run_updater.generator.fail = False
+    run_updater.run()
+    assert run_updater.generator.calls == 2
+    assert run_updater.digest_file.exists()
+
+
+def test_setup_logging_starts_one_listener(updater, tmp_path, monkeypatch):
+    """Repeated setup reuses the configured logging instead of leaking."""
+    monkeypatch.setattr(auto_updater, "__file__", str(tmp_path / "s" / "u.py"))
+    monkeypatch.setattr(logging.getLogger(), "handlers", [])
+    stops = []
+    monkeypatch.setattr(auto_updater.atexit, "register", stops.append)
+    updater._setup_logging()
+    updater._setup_logging()
+    for stop in stops:
+        stop()
+    assert len(stops) == 1
+
+
+@pytest.mark.parametrize(
+    "host, country, city",
+    [
+        # Substrings inside longer labels no longer match
+        ("russia.example.com", "XX", "Unknown"),
+        ("ukraine-node.example.net", "XX", "Unknown"),
+        ("sydney.example.com", "XX", "Unknown"),
+        # Hyphen- and dot-separated labels do
+        ("us-east-1.example.com", "US", "Unknown"),
+        ("node.jp.tokyo.example.com", "JP", "Tokyo"),
+        ("germany-frankfurt.example.com", "DE", "Frankfurt"),
+        ("fr.paris.example.com", "FR", "Paris"),
+        ("sg-singapore.example.com", "SG", "Singapore"),
+        ("ny-01.example.com", "XX", "New York"),
+    ],
+)
+def test_guess_country_and_city(host, country, city):
+    """Geo guesses match whole hostname labels with XX/Unknown fallbacks."""
+    assert auto_updater._guess_country(host) == country
+    assert auto_updater._guess_city(host) == city
+
+
+def test_convert_servers_format_caps_hosts(updater):
+    """New hosts past the cap are skipped, kept hosts still merge ports."""
+    servers = [
+        {"protocol": "shadowsocks", "host": f"h{i}.example.com", "port": 1000 + i}
+        for i in range(12)
+    ]
+    servers += [
+        {"protocol": "vmess", "host": "h11.example.com", "port": 2083},
+        {"protocol": "vmess", "host": "h0.example.com", "port": 2053},
+    ]
+    converted = updater._convert_servers_format(servers)
+    assert [s["host"] for s in converted] == [
+        f"h{i}.example.com" for i in range(auto_updater._MAX_SERVERS)
+    ]
+    assert converted[0]["ports"] == {
+        "shadowsocks": 1000, "vmess": 2053, "trojan": 443
+    }
+    assert converted[1]["ports"]["vmess"] == 10086
+
+
+def test_init_creates_cache_dir_with_logging_configured(tmp_path, monkeypatch):
+    """The cache directory exists even if logging setup returns early."""
+    monkeypatch.setattr(auto_updater, "__file__", str(tmp_path / "s" / "u.py"))
+    monkeypatch.setattr(logging.getLogger(), "handlers", [logging.NullHandler()])
+    updater = auto_updater.ProxyUpdater()
+    updater._save_source_cache()
+    assert updater.cache_file.exists()
+
+
+class _FakeSession:
+    """Answers every GET with a 200 carrying a fixed body."""
+
+    status_code = 200
+    headers: dict = {}
+
+    def __init__(self, content):
+        self.content = content
+
+    def get(self, url, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.mark.parametrize("wrap", [0, 16])
+def test_fetch_subscription_decodes_unpadded_body(updater, wrap):
+    """URL-safe, unpadded and line-wrapped subscription bodies decode."""
+    lines = "trojan://pw@t.example.com:8443#t\ntrojan://pw@u.example.com:443#u"
+    body = base64.urlsafe_b64encode(lines.encode()).rstrip(b"=")
+    assert len(body) % 4  # the padding really is missing
+    if wrap:
+        body = b"\n".join(
+            body[i:i + wrap] for i in range(0, len(body), wrap)
+        )
+    updater.logger = logging.getLogger("test_auto_updater")
+    updater.source_cache = {}
+    updater._parsers = {b"trojan": updater._parse_trojan_url}
+    updater.session = _FakeSession(body)
+    servers = updater._fetch_from_subscription({"name": "n", "url": "https://x"})
+    assert [s["host"] for s in servers] == ["t.example.com", "u.example.com"]
@@ -0,0 +1,138 @@
+"""Tests for subscription export in the proxy generator."""
+
+import base64
+import json
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "scripts"))
+
+proxy_generator = pytest.importorskip("proxy_generator")
+
+
+@pytest.fixture
+def generator():
+    """A ProxyGenerator loaded with two sample servers."""
+    gen = proxy_generator.ProxyGenerator()
+    gen.update_servers([
+        {
+            "host": "us.example.com",
+            "country": "US",
+            "city": "New York",
+            "ports": {"shadowsocks": 8388, "vmess": 10086, "trojan": 443},
+        },
+        {
+            "host": "jp.example.com",
+            "country": "JP",
+            "city": "Tokyo",
+            "ports": {"vmess": 2053},
+        },
+    ])
+    return gen
+
+
+def test_generate_password_alphabet():
+    """Passwords have the requested length and URL-safe characters."""
+    gen = proxy_generator.ProxyGenerator()
+    for length in (16, 32):
+        password = gen._generate_password(length)
+        assert len(password) == length
+        assert set(password) <= set(proxy_generator._PASSWORD_ALPHABET)
+
+
+def test_universal_subscription_groups_by_protocol(generator):
+    """The universal export lists every ss, then vmess, then trojan URL."""
+    lines = generator.export_universal_subscription().split("\n")
+    schemes = [line.split("://", 1)[0] for line in lines]
+    assert schemes == ["ss", "ss", "vmess", "vmess", "trojan", "trojan"]
+
+
+def test_shadowsocks_subscription(generator):
+    """Shadowsocks URLs carry the port and quoted remarks."""
+    first, second = generator.export_shadowsocks_subscription().split("\n")
+    assert first.startswith("ss://")
+    assert first.endswith("@us.example.com:8388#SS-US-New%20York")
+    assert "@jp.example.com:8388#" in second
+
+
+def test_vmess_subscription_payload(generator):
+    """VMess URLs encode a JSON payload with the server address."""
+    first = generator.export_vmess_subscription().split("\n")[0]
+    payload = json.loads(base64.b64decode(first[len("vmess://"):]))
+    assert payload["add"] == "us.example.com"
+    assert payload["port"] == "10086"
+    assert payload["ps"] == "VMess-US-New York"
+
+
+def test_universal_subscription_base64_roundtrip(generator):
+    """The base64 export decodes to a plain universal subscription."""
+    decoded = base64.b64decode(
+        generator.export_universal_subscription_base64()
+    ).decode()
+    assert len(decoded.split("\n")) == 6
+    assert all(
+        line.startswith(("ss://", "vmess://", "trojan://"))
+        for line in decoded.split("\n")
+    )
+
+
+def test_write_config_replaces_file(tmp_path):
+    """Config writes replace the target and leave no temp file behind."""
+    target = tmp_path / "universal.txt"
+    target.write_text("old", encoding="utf-8")
+    proxy_generator.ProxyGenerator()._write_config(target, "new")
+    assert target.read_text(encoding="utf-8") == "new"
+    assert [p.name for p in tmp_path.iterdir()] == ["universal.txt"]
+
+
+def test_uuid4_str_is_version_4():
+    """Generated VMess ids parse as RFC 4122 version 4 UUIDs."""
+    value = proxy_generator._uuid4_str()
+    parsed = uuid.UUID(value)
+    assert str(parsed) == value
+    assert parsed.version == 4
+    assert parsed.variant == uuid.RFC_4122
+
+
+def test_generate_all_configs_share_credentials(generator, tmp_path, monkeypatch):
+    """Every output file is built from the same single pass of links."""
+    monkeypatch.setattr(proxy_generator, "__file__", str(tmp_path / "s" / "g.py"))
+    generator.generate_all_configs()
+    config_dir = tmp_path / "configs"
+    assert sorted(config_dir.iterdir()) == sorted(generator.output_paths())
+    universal = (config_dir / "universal.txt").read_text().split("\n")
+    shadowsocks = (config_dir / "shadowsocks.txt").read_text().split("\n")
+    vmess = (config_dir / "v2ray.txt").read_text().split("\n")
+    assert universal[:4] == shadowsocks + vmess
+    assert base64.b64decode(
+        (config_dir / "universal-base64.txt").read_text()
+    ).decode().split("\n") == universal
+
+
+def test_vmess_url_matches_vmess_config(generator):
+    """The templated VMess payload mirrors generate_vmess_config."""
+    server = {**generator.servers[0], "city": 'Quote"City'}
+    url = generator._vmess_url(server)
+    payload = json.loads(base64.b64decode(url[len("vmess://"):]))
+    expected = generator.generate_vmess_config(server)
+    assert list(payload) == list(expected)
+    del payload["id"], expected["id"]
+    assert payload == expected
+
+
+def test_write_config_removes_temp_file_on_failure(tmp_path, monkeypatch):
+    """A failed write keeps the old file and cleans up the temp file."""
+    target = tmp_path / "universal.txt"
+    target.write_bytes(b"old")
+
+    def fail_fsync(fd):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(proxy_generator.os, "fsync", fail_fsync)
+    with pytest.raises(OSError):
+        proxy_generator.ProxyGenerator()._write_config(target, b"new")
+    assert target.read_bytes() == b"old"
+    assert [p.name for p in tmp_path.iterdir()] == ["universal.txt"]
@@ -0,0 +1,40 @@
+"""Tests for initial config generation in the setup script."""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "scripts"))
+
+setup = pytest.importorskip("setup")
+
+
+@pytest.fixture
+def proxy_setup(tmp_path, monkeypatch):
+    """A ProxySetup whose generator writes into a temporary project."""
+    proxy_setup = setup.ProxySetup()
+    generator_module = proxy_setup._load_generator_module()
+    monkeypatch.setattr(
+        generator_module, "__file__", str(tmp_path / "scripts" / "g.py")
+    )
+    return proxy_setup
+
+
+def test_generate_initial_configs_keeps_existing(proxy_setup, tmp_path):
+    """Published configs are never overwritten with empty ones."""
+    config_dir = tmp_path / "configs"
+    config_dir.mkdir()
+    (config_dir / "universal.txt").write_text("ss://published")
+    proxy_setup.generate_initial_configs()
+    assert [p.name for p in config_dir.iterdir()] == ["universal.txt"]
+    assert (config_dir / "universal.txt").read_text() == "ss://published"
+
+
+def test_generate_initial_configs_writes_full_set(proxy_setup, tmp_path):
+    """A fresh checkout gets all generated files at once."""
+    proxy_setup.generate_initial_configs()
+    generator_module = proxy_setup._load_generator_module()
+    assert sorted(p.name for p in (tmp_path / "configs").iterdir()) == sorted(
+        generator_module.OUTPUT_FILES
+    )